@@ -1,16 +1,19 @@
 import streamlit as st
 import pandas as pd
+import pyarrow as pa
+from collections import OrderedDict
 from helpers import (
     setup_google_auth, setup_textrazor_auth, init_mongo_connection, 
-    get_db_collection, crawl_site, get_metrics_df, analyze_google, 
+    get_db_collection, crawl_site, get_metrics_df, get_seo_report, get_collection_version, get_page_doc, get_near_duplicates, analyze_google, 
     analyze_textrazor, scrape_external_page, fetch_bing_backlinks,
-    run_technical_audit, 
-    NLP_AVAILABLE, TEXTRAZOR_AVAILABLE
+    run_technical_audit, search_pages,
+    NLP_AVAILABLE, TEXTRAZOR_AVAILABLE, DATASKETCH_AVAILABLE
 )
 
 # --- CONFIG ---
 st.set_page_config(page_title="SeoSpider Pro", page_icon="🕸️", layout="wide")
-st.markdown("""
+
+APP_CSS = """
 <style>
     .stTabs [data-baseweb="tab-list"] { gap: 8px; }
     .stTabs [data-baseweb="tab"] {
@@ -28,7 +31,8 @@ st.markdown("""
     .metric-desc { font-size: 0.9rem; opacity: 0.7; margin-bottom: 10px; }
     div[data-testid="stDataFrame"] { width: 100%; }
 </style>
-""", unsafe_allow_html=True)
+"""
+st.markdown(APP_CSS, unsafe_allow_html=True)
 
 # --- SETUP ---
 google_auth_status = setup_google_auth()
@@ -54,9 +58,24 @@ with st.sidebar:
     
     if st.button("Start Crawl", type="primary"):
         crawl_site(target_url)
+        get_metrics_df.clear()
+        get_seo_report.clear()
+        get_page_doc.clear()
+        get_near_duplicates.clear()
+        st.session_state.pop("search_cache", None)
+        st.rerun()
+
+    if st.button("Refresh Data"):
+        get_metrics_df.clear()
+        get_seo_report.clear()
+        get_page_doc.clear()
+        get_near_duplicates.clear()
+        st.session_state.pop("search_cache", None)
         st.rerun()
 
 # --- HELPER UI ---
+LINK_COLUMNS = {'url': st.column_config.LinkColumn("URL"), 'Page': st.column_config.LinkColumn("Page")}
+
 def display_metric_block(title, count, df_data, color_hex, display_cols):
     st.markdown(f"""
     <div class="metric-card" style="background-color: {color_hex};">
@@ -64,29 +83,16 @@ def display_metric_block(title, count, df_data, color_hex, display_cols):
         <div class="metric-value">{count}</div>
         <div class="metric-desc">Click dropdown to view details</div>
     </div>""", unsafe_allow_html=True)
-    
-    if count > 0:
-        with st.expander(f"Show Details for {title}"):
-            if isinstance(df_data, list):
-                df_display = pd.DataFrame(df_data)
-            elif isinstance(df_data, pd.DataFrame):
-                valid_cols = [c for c in display_cols if c in df_data.columns]
-                df_display = df_data[valid_cols]
-            else:
-                return
-
-            column_config = {}
-            if 'url' in df_display.columns:
-                column_config['url'] = st.column_config.LinkColumn("URL")
-            if 'Page' in df_display.columns:
-                column_config['Page'] = st.column_config.LinkColumn("Page")
+    if count == 0: return
 
-            st.dataframe(
-                df_display, 
-                width="stretch", 
-                column_config=column_config,
-                hide_index=True
-            )
+    with st.expander(f"Show Details for {title}"):
+        df_display = df_data[[c for c in display_cols if c in df_data.columns]]
+        st.dataframe(
+            df_display, 
+            width="stretch", 
+            column_config={c: cfg for c, cfg in LINK_COLUMNS.items() if c in df_display.columns},
+            hide_index=True
+        )
 
 # --- MAIN UI ---
 tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
@@ -97,110 +103,136 @@ tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
     "🔗 Backlinks", 
     "🛠️ Deep Tech Audit"
 ])
-df = get_metrics_df()
+data_version = get_collection_version()
+# A None version means the collection couldn't be read; calling the cached loaders with it would
+# persist that frame to disk under a key that never changes
+df = get_metrics_df(data_version) if data_version is not None else None
+# Documents are keyed by URL, so the column is already unique
+page_urls = df['url'] if df is not None else []
 
 # TAB 1: SEO REPORT
 with tab1:
-    if df is not None:
+    report = get_seo_report(data_version) if df is not None else None
+    if report is not None:
         st.subheader("Site Health Overview")
         
-        dup_content = df[df.duplicated(subset=['content_hash'], keep=False) & (df['content_hash'] != "")]
-        display_metric_block("Duplicate Content Pages", len(dup_content), dup_content, "#FFB3BA", ['url', 'title'])
+        col_exact, col_near = st.columns(2)
+        with col_exact:
+            dup_content = report['dup_content']
+            display_metric_block("Duplicate Content Pages", len(dup_content), dup_content, "#FFB3BA", ['url', 'title'])
+        with col_near:
+            if DATASKETCH_AVAILABLE:
+                near_dups = get_near_duplicates(data_version)
+                if near_dups is not None:
+                    display_metric_block("Near-Duplicate Content", len(near_dups), near_dups, "#FFC8DD", ['url', 'group'])
+            else: st.caption("Install 'datasketch' to detect near-duplicate content.")
 
         col1, col2 = st.columns(2)
         with col1:
-            dup_title = df[df.duplicated(subset=['title'], keep=False) & (df['title'] != "")]
+            dup_title = report['dup_title']
             display_metric_block("Duplicate Meta Titles", len(dup_title), dup_title, "#FFDFBA", ['url', 'title'])
         with col2:
-            dup_desc = df[df.duplicated(subset=['meta_desc'], keep=False) & (df['meta_desc'] != "")]
+            dup_desc = report['dup_desc']
             display_metric_block("Duplicate Meta Desc", len(dup_desc), dup_desc, "#FFFFBA", ['url', 'meta_desc'])
 
         col3, col4 = st.columns(2)
         with col3:
-            def check_canonical(row):
-                if not row['canonical']: return False
-                return row['canonical'] != row['url']
-            canon_issues = df[df.apply(check_canonical, axis=1)]
+            canon_issues = report['canon_issues']
             display_metric_block("Canonical Issues", len(canon_issues), canon_issues, "#BAFFC9", ['url', 'canonical'])
         with col4:
-            missing_alt_data = []
-            for _, row in df.iterrows():
-                if isinstance(row['images'], list):
-                    for img in row['images']:
-                        if not img.get('alt'): missing_alt_data.append({'Page': row['url'], 'Image Src': img.get('src')})
-            display_metric_block("Missing Alt Tags", len(missing_alt_data), missing_alt_data, "#BAE1FF", ['Page', 'Image Src'])
+            missing_alt = report['missing_alt']
+            display_metric_block("Missing Alt Tags", len(missing_alt), missing_alt, "#BAE1FF", ['Page', 'Image Src'])
 
-        col5, col6, col7, col8 = st.columns(4)
+        col5, col6, col7, col8, col9, col10 = st.columns(6)
         with col5:
-             broken = df[df['status_code'] == 404]
+             broken = report['broken']
              display_metric_block("Broken Pages (404)", len(broken), broken, "#FFCCE5", ['url', 'status_code'])
         with col6:
-            r300 = df[(df['status_code'] >= 300) & (df['status_code'] < 400)]
+            r300 = report['r300']
             display_metric_block("3xx Redirects", len(r300), r300, "#E2B3FF", ['url', 'status_code'])
         with col7:
-            r400 = df[(df['status_code'] >= 400) & (df['status_code'] < 500)]
+            r400 = report['r400']
             display_metric_block("4xx Errors", len(r400), r400, "#FF9AA2", ['url', 'status_code'])
         with col8:
-             r500 = df[df['status_code'] >= 500]
+             r500 = report['r500']
              display_metric_block("5xx Errors", len(r500), r500, "#C7CEEA", ['url', 'status_code'])
-
-        col9, col10 = st.columns(2)
         with col9:
-            indexable = df[df['indexable'] == True]
+            indexable = report['indexable']
             display_metric_block("Indexable Pages", len(indexable), indexable, "#B5EAD7", ['url', 'title'])
         with col10:
-            non_indexable = df[df['indexable'] == False]
+            non_indexable = report['non_indexable']
             display_metric_block("Non-Indexable Pages", len(non_indexable), non_indexable, "#FFDAC1", ['url', 'title'])
 
-        h1_issues = df[(df['h1_count'] == 0) | (df['h1_count'] > 1)]
+        h1_issues = report['h1_issues']
         display_metric_block("On-Page Heading Issues", len(h1_issues), h1_issues, "#E2F0CB", ['url', 'h1_count'])
 
-        thin_content = df[df['word_count'] < 200]
+        thin_content = report['thin_content']
         display_metric_block("Thin Content (<200 words)", len(thin_content), thin_content, "#F7D9C4", ['url', 'word_count'])
 
-        slow_pages = df[df['latency_ms'] > 1500]
+        slow_pages = report['slow_pages']
         display_metric_block("Slow Pages (> 1.5s)", len(slow_pages), slow_pages, "#D7E3FC", ['url', 'latency_ms'])
     else:
         st.info("No crawl data available. Please start a crawl from the sidebar.")
 
 # TAB 2: GOOGLE NLP
-with tab2:
+@st.fragment
+def render_google_nlp():
     st.subheader("Google NLP Analysis")
     if df is not None and google_auth_status and NLP_AVAILABLE:
-        from google.cloud import language_v1 
-        url_sel = st.selectbox("Select Page for G-NLP:", df['url'].unique(), key="gnlp_sel")
+        url_sel = st.selectbox("Select Page for G-NLP:", page_urls, key="gnlp_sel")
         if st.button("Analyze with Google"):
-            doc = get_db_collection().find_one({"url": url_sel})
+            doc = get_page_doc(url_sel, ("page_text",), data_version) or {}
             res, err = analyze_google(doc.get('page_text', ''))
             if res:
                 s = res['sentiment']
                 c1, c2 = st.columns(2)
-                c1.metric("Sentiment", f"{s.score:.2f}")
-                c2.metric("Magnitude", f"{s.magnitude:.2f}")
-                ents = [{"Name": e.name, "Type": language_v1.Entity.Type(e.type_).name, "Salience": f"{e.salience:.1%}"} for e in res['entities'][:10]]
+                c1.metric("Sentiment", f"{s['score']:.2f}")
+                c2.metric("Magnitude", f"{s['magnitude']:.2f}")
+                ents = [{"Name": e['name'], "Type": e['type'], "Salience": f"{e['salience']:.1%}"} for e in res['entities'][:10]]
                 st.dataframe(pd.DataFrame(ents), width="stretch")
             else: st.error(err)
     elif not google_auth_status:
         st.warning("Google NLP is not active. Check credentials.")
 
+with tab2:
+    render_google_nlp()
+
 # TAB 3: SEARCH
-with tab3:
-    q = st.text_input("Deep Search:")
+SEARCH_CACHE_SIZE = 32
+
+@st.fragment
+def render_deep_search():
+    # Query runs on submit, not on every keystroke
+    with st.form("deep_search_form"):
+        q = st.text_input("Deep Search:")
+        st.form_submit_button("Search")
     if q and get_db_collection() is not None:
-        res = list(get_db_collection().find({"page_text": {"$regex": q, "$options": "i"}}).limit(20))
-        if res:
-            data = [{"URL": r['url'], "Match": "..." + r['page_text'][r['page_text'].lower().find(q.lower()):][:100] + "..."} for r in res]
-            st.dataframe(pd.DataFrame(data), width="stretch")
+        # Results per query are kept for the session so unrelated reruns don't re-query Mongo.
+        # The version is re-read here because fragment reruns skip the top-level load, and a crawl
+        # from another session must invalidate old results
+        cache = st.session_state.setdefault("search_cache", OrderedDict())
+        key = (get_collection_version(), q)
+        if key not in cache:
+            # Stored as an Arrow table, which st.dataframe serializes without a pandas round-trip
+            cache[key] = pa.Table.from_pylist([{"URL": r['url'], "Match": "..." + r['snippet'] + "..."} for r in search_pages(q)])
+            if len(cache) > SEARCH_CACHE_SIZE: cache.popitem(last=False)
+        data = cache[key]
+        if data.num_rows:
+            st.dataframe(data, width="stretch")
+
+with tab3:
+    render_deep_search()
 
 # TAB 4: CONTENT INTELLIGENCE
-with tab4:
+@st.fragment
+def render_content_analysis():
     st.subheader("Content Intelligence")
     if df is not None:
-        tr_url_sel = st.selectbox("Select Page for Analysis:", df['url'].unique(), key="tr_sel")
+        tr_url_sel = st.selectbox("Select Page for Analysis:", page_urls, key="tr_sel")
         
         # --- SECTION: IMAGE OCR RESULTS ---
         st.markdown("#### 🖼️ Image Text Extraction (OCR)")
-        doc = get_db_collection().find_one({"url": tr_url_sel})
+        doc = get_page_doc(tr_url_sel, ("images",), data_version)
         
         if doc and 'images' in doc and doc['images']:
             ocr_images = [img for img in doc['images'] if img.get('ocr_text')]
@@ -227,23 +259,27 @@ with tab4:
     elif not textrazor_auth_status: st.error("Please add TextRazor API key.")
     elif df is not None:
         if st.button("Analyze Page Text (TextRazor)"):
-            doc = get_db_collection().find_one({"url": tr_url_sel})
+            doc = get_page_doc(tr_url_sel, ("page_text",), data_version) or {}
             with st.spinner("Processing..."):
                 resp, err = analyze_textrazor(doc.get('page_text', ''), textrazor_auth_status)
                 if resp:
                     c1, c2 = st.columns(2)
                     with c1:
                         st.markdown("**Top Entities**")
-                        ents = [{"ID": e.id, "Relevance": f"{e.relevance_score:.2f}"} for e in sorted(resp.entities(), key=lambda x: x.relevance_score, reverse=True)[:10]]
+                        ents = [{"ID": e['id'], "Relevance": f"{e['relevance']:.2f}"} for e in resp['entities'][:10]]
                         st.dataframe(pd.DataFrame(ents), width="stretch")
                     with c2:
                         st.markdown("**Top Topics**")
-                        tops = [{"Label": t.label, "Score": f"{t.score:.2f}"} for t in sorted(resp.topics(), key=lambda x: x.score, reverse=True)[:10]]
+                        tops = [{"Label": t['label'], "Score": f"{t['score']:.2f}"} for t in resp['topics'][:10]]
                         st.dataframe(pd.DataFrame(tops), width="stretch")
                 else: st.error(err)
 
+with tab4:
+    render_content_analysis()
+
 # TAB 5: BACKLINKS
-with tab5:
+@st.fragment
+def render_backlinks():
     st.subheader("Inbound Link Checker")
     st.info("Check official backlinks from Bing Webmaster Tools.")
     
@@ -272,8 +308,12 @@ with tab5:
                     else:
                         st.error(f"Error fetching data: {err}")
 
+with tab5:
+    render_backlinks()
+
 # TAB 6: DEEP TECH AUDIT
-with tab6:
+@st.fragment
+def render_tech_audit():
     st.subheader("Deep Technical SEO Audit")
     st.info("Powered by python-seo-analyzer. This runs a separate, rigorous scan of your target URL.")
     
@@ -323,3 +363,6 @@ with tab6:
                             
                 else:
                     st.error(f"Audit Failed: {err}")
+
+with tab6:
+    render_tech_audit()
@@ -1,43 +1,41 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin, urlparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from queue import Queue
+from collections import deque
+import threading
 import pymongo
+from pymongo import UpdateOne, WriteConcern
+from pymongo.errors import OperationFailure
 import tempfile
 import time
 import hashlib
+import importlib.util
+import re
 import os
 import json
 import urllib3
 from datetime import datetime
+from functools import lru_cache
 
 # --- SAFE IMPORTS ---
-try:
-    from google.cloud import language_v1
-    from google.cloud import vision
-    NLP_AVAILABLE = True
-except ImportError:
-    NLP_AVAILABLE = False
+# Optional libraries are checked here and imported on first use
+def module_available(name):
+    try: return importlib.util.find_spec(name) is not None
+    except ModuleNotFoundError: return False
 
-try:
-    import textrazor
-    TEXTRAZOR_AVAILABLE = True
-except ImportError:
-    TEXTRAZOR_AVAILABLE = False
-
-try:
-    import cloudscraper
-    SCRAPER_AVAILABLE = True
-except ImportError:
-    SCRAPER_AVAILABLE = False
-
-try:
-    # NOTE: The package is 'pyseoanalyzer' but the import is 'seoanalyzer'
-    from seoanalyzer import analyze as run_seo_audit
-    SEO_LIB_AVAILABLE = True
-except ImportError:
-    SEO_LIB_AVAILABLE = False
+NLP_AVAILABLE = module_available("google.cloud.language_v1") and module_available("google.cloud.vision")
+TEXTRAZOR_AVAILABLE = module_available("textrazor")
+SCRAPER_AVAILABLE = module_available("cloudscraper")
+# NOTE: The package is 'pyseoanalyzer' but the import is 'seoanalyzer'
+SEO_LIB_AVAILABLE = module_available("seoanalyzer")
+DATASKETCH_AVAILABLE = module_available("datasketch")
 
 # Suppress SSL warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -65,6 +63,7 @@ def setup_google_auth():
 
 def setup_textrazor_auth():
     if TEXTRAZOR_AVAILABLE and "textrazor" in st.secrets and "api_key" in st.secrets["textrazor"]:
+        import textrazor
         textrazor.api_key = st.secrets["textrazor"]["api_key"]
         return True
     return False
@@ -74,11 +73,12 @@ def setup_textrazor_auth():
 def init_mongo_connection():
     try:
         uri = st.secrets["mongo"]["uri"]
-        client = pymongo.MongoClient(uri, serverSelectionTimeoutMS=5000)
+        client = pymongo.MongoClient(uri, serverSelectionTimeoutMS=5000, maxPoolSize=50, appname="salspi-streamlit", compressors="zlib")
         client.admin.command('ping')
         return client
     except Exception: return None
 
+@st.cache_resource(show_spinner=False)
 def get_db_collection():
     client = init_mongo_connection()
     if client:
@@ -86,10 +86,74 @@ def get_db_collection():
         except KeyError: return None
     return None
 
+@st.cache_resource(show_spinner=False)
+def ensure_search_index():
+    collection = get_db_collection()
+    if collection is None: return False
+    try:
+        collection.create_index(
+            [("page_text", "text"), ("title", "text"), ("meta_desc", "text")],
+            name="page_search", default_language="english"
+        )
+        return True
+    except Exception: return False
+
+# Backs the latest-crawl_time lookup in get_collection_version, which runs on every rerun
+@st.cache_resource(show_spinner=False)
+def ensure_version_index():
+    collection = get_db_collection()
+    if collection is None: return False
+    try:
+        collection.create_index("crawl_time")
+        return True
+    except Exception: return False
+
+# --- SEARCH ---
+def search_pages(query, limit=20, width=100):
+    col = get_db_collection()
+    if col is None: return []
+    # Without the text index (e.g. createIndex not permitted) $text would fail, so go straight to the substring scan
+    if ensure_search_index():
+        # Multi-word queries are matched as a phrase (index lookup, then phrase check on the candidates)
+        phrase = " " in query.strip() and '"' not in query
+        search = f'"{query}"' if phrase else query
+        tokens = re.findall(r"\w+", query.lower())
+        needle = query.lower().strip() if phrase or not tokens else max(tokens, key=len)
+        try:
+            hits = list(col.aggregate([
+                {"$match": {"$text": {"$search": search}}},
+                {"$sort": {"score": {"$meta": "textScore"}}},
+                {"$limit": limit},
+                snippet_projection(needle, width),
+            ]))
+            if hits: return hits
+        except OperationFailure: pass
+
+    # $text only matches whole (stemmed) words, so partial words and stop words fall back to a substring scan
+    literal = query.strip().strip('"')
+    if not literal: return []
+    pattern = re.compile(re.escape(literal), re.IGNORECASE)
+    return list(col.aggregate([
+        {"$match": {"page_text": pattern}},
+        {"$limit": limit},
+        snippet_projection(literal.lower(), width),
+    ]))
+
+# The snippet is cut server-side so only `width` characters per hit cross the wire, not the whole page_text
+def snippet_projection(needle, width):
+    start = {"$max": [{"$indexOfCP": [{"$toLower": "$page_text"}, needle]}, 0]}
+    return {"$project": {"_id": 0, "url": 1, "snippet": {"$substrCP": ["$page_text", start, width]}}}
+
 # --- UTILS ---
+WHITESPACE_RE = re.compile(r'\s+')
+
+# Case and whitespace are normalized so pages differing only in markup spacing hash the same
 def get_page_hash(content):
-    return hashlib.md5(content.encode('utf-8')).hexdigest()
+    normalized = WHITESPACE_RE.sub(' ', content).strip().lower()
+    return hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).hexdigest()
 
+# Pages share most of their nav/footer links, so memoize the per-link URL parsing
+@lru_cache(maxsize=65536)
 def normalize_url(url):
     try:
         parsed = urlparse(url)
@@ -97,11 +161,21 @@ def normalize_url(url):
         return clean.rstrip('/')
     except: return url
 
+@lru_cache(maxsize=65536)
+def get_url_host(url):
+    return urlparse(url).netloc
+
 # --- IMAGE OCR ---
+@st.cache_resource(show_spinner=False)
+def get_vision_client():
+    from google.cloud import vision
+    return vision.ImageAnnotatorClient()
+
 def detect_text_in_image(image_url):
     if not NLP_AVAILABLE: return None
     try:
-        client = vision.ImageAnnotatorClient()
+        from google.cloud import vision
+        client = get_vision_client()
         image = vision.Image()
         image.source.image_uri = image_url
         response = client.text_detection(image=image)
@@ -131,12 +205,127 @@ def run_technical_audit(site_url):
         return None, "pyseoanalyzer library missing. Please add 'pyseoanalyzer' to requirements.txt and Reboot."
     
     try:
+        from seoanalyzer import analyze as run_seo_audit
         output = run_seo_audit(site_url)
         return output, None
     except Exception as e:
         return None, f"Audit Failed: {str(e)}"
 
 # --- CRAWLER LOGIC ---
+MONGO_BATCH_SIZE = 100
+CRAWL_MAX_PAGES = 1000
+CRAWL_WORKERS = 8
+CRAWL_HOST_RATE = 10  # max requests per second to a single host
+MAX_PAGE_BYTES = 2 * 1024 * 1024  # HTML bodies beyond this are truncated before parsing
+PROGRESS_INTERVAL = 0.1  # seconds; caps crawl UI updates at ~10 per second
+CRAWLER_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+@st.cache_resource(show_spinner=False)
+def get_http_adapter():
+    return HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=Retry(total=3, backoff_factor=0.3))
+
+# Connection pools are shared through the adapter; each crawl gets its own session so cookies don't carry over
+def get_http_session(user_agent):
+    session = requests.Session()
+    session.headers.update({'User-Agent': user_agent})
+    adapter = get_http_adapter()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+class HostRateLimiter:
+    # Hands out per-host request slots `1 / rate` seconds apart, so concurrent workers stay polite
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_slot = {}
+        self.lock = threading.Lock()
+
+    def wait(self, host):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        time.sleep(slot - now)
+
+    def back_off(self, host, seconds):
+        with self.lock:
+            self.next_slot[host] = max(self.next_slot.get(host, 0.0), time.monotonic() + seconds)
+
+def fetch_page(url, base_domain, session, limiter):
+    host = get_url_host(url)
+    limiter.wait(host)
+    start_time = time.time()
+    # Headers come first; only HTML bodies are downloaded, and at most MAX_PAGE_BYTES of them
+    with session.get(url, timeout=15, verify=False, stream=True) as response:
+        is_html = response.status_code == 200 and 'text/html' in response.headers.get('Content-Type', '')
+        body = bytearray()
+        if is_html:
+            for chunk in response.iter_content(65536):
+                body += chunk
+                if len(body) >= MAX_PAGE_BYTES: break
+    latency = (time.time() - start_time) * 1000
+    retry_after = response.headers.get('Retry-After', '')
+    if response.status_code in (429, 503) and retry_after.isdigit():
+        limiter.back_off(host, min(int(retry_after), 60))
+    final_url = normalize_url(response.url)
+    
+    page_data = {
+        "url": final_url, "domain": base_domain, "status_code": response.status_code,
+        "content_type": response.headers.get('Content-Type', ''), "crawl_time": datetime.now(),
+        "latency_ms": latency, "links": [], "images": [], "title": "", "meta_desc": "",
+        "canonical": "", "page_text": "", "content_hash": "", "indexable": True, "h1_count": 0, "word_count": 0,
+        "alt_missing_count": 0
+    }
+
+    if is_html:
+        # Same fallback as response.text: an unknown charset decodes as utf-8 instead of failing the page
+        try: html = body[:MAX_PAGE_BYTES].decode(response.encoding or 'utf-8', errors='replace')
+        except (LookupError, TypeError): html = body[:MAX_PAGE_BYTES].decode('utf-8', errors='replace')
+        soup = BeautifulSoup(html, 'lxml')
+        page_data['title'] = soup.title.string.strip() if soup.title and soup.title.string else ""
+        meta = soup.find('meta', attrs={'name': 'description'})
+        page_data['meta_desc'] = meta['content'].strip() if meta and meta.get('content') else ""
+        canon = soup.find('link', rel='canonical')
+        page_data['canonical'] = canon['href'] if canon else ""
+        page_data['h1_count'] = len(soup.find_all('h1'))
+        
+        for s in soup(["script", "style"]): s.extract()
+        text_content = soup.get_text(separator=' ', strip=True)
+        page_data['page_text'] = text_content
+        page_data['content_hash'] = get_page_hash(text_content)
+        page_data['word_count'] = len(text_content.split())
+        
+        imgs_found = soup.find_all('img')
+        for i, img in enumerate(imgs_found):
+            src = img.get('src')
+            if src:
+                abs_src = urljoin(url, src)
+                img_data = {'src': abs_src, 'alt': img.get('alt', ''), 'ocr_text': None}
+                if i < 5:
+                    detected_text = detect_text_in_image(abs_src)
+                    if detected_text: img_data['ocr_text'] = detected_text
+                page_data['images'].append(img_data)
+                if not img_data['alt']: page_data['alt_missing_count'] += 1
+        
+        robots = soup.find('meta', attrs={'name': 'robots'})
+        if robots and 'noindex' in robots.get('content', '').lower(): page_data['indexable'] = False
+        
+        for link in soup.find_all('a', href=True):
+            raw = link['href'].strip()
+            if not raw or raw.startswith(('mailto:', 'tel:', 'javascript:', '#')): continue
+            abs_link = normalize_url(urljoin(url, raw))
+            if base_domain in get_url_host(abs_link):
+                page_data['links'].append(abs_link)
+
+    return page_data
+
+def mongo_writer(collection, batches, errors):
+    while True:
+        batch = batches.get()
+        if batch is None: return
+        try: collection.bulk_write(batch, ordered=False)
+        except Exception as e: errors.append(str(e))
+
 def crawl_site(start_url):
     collection = get_db_collection()
     if collection is None:
@@ -144,154 +333,268 @@ def crawl_site(start_url):
         return
     
     collection.delete_many({})
+    ensure_version_index()
     start_url = normalize_url(start_url)
     base_domain = urlparse(start_url).netloc.replace('www.', '')
     
-    queue = [start_url]
-    visited = set()
+    # Every URL is enqueued at most once: `seen` covers both the frontier and pages already crawled
+    queue = deque([start_url])
+    seen = {start_url}
     count = 0
+    pending = []
+    in_flight = {}
+    last_progress = 0.0
+    # Bounded so a slow database applies back-pressure instead of buffering the whole crawl
+    batches = Queue(maxsize=4)
+    write_errors = []
+    # Crawl data is re-creatable by re-crawling, so batches are acknowledged without waiting on the journal
+    crawl_writes = collection.with_options(write_concern=WriteConcern(w=1, j=False))
+    writer = threading.Thread(target=mongo_writer, args=(crawl_writes, batches, write_errors), daemon=True)
+    writer.start()
     
     progress_bar = st.progress(0)
     status_text = st.empty()
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'}
+    session = get_http_session(CRAWLER_USER_AGENT)
+    limiter = HostRateLimiter(CRAWL_HOST_RATE)
     
-    while queue and count < 1000:
-        url = queue.pop(0)
-        if url in visited: continue
-        visited.add(url)
-        count += 1
-        progress_bar.progress(count / 1000)
-        status_text.text(f"Crawling {count}: {url}")
-        
-        try:
-            time.sleep(0.1)
-            start_time = time.time()
-            response = requests.get(url, headers=headers, timeout=15, verify=False)
-            latency = (time.time() - start_time) * 1000
-            final_url = normalize_url(response.url)
-            
-            page_data = {
-                "url": final_url, "domain": base_domain, "status_code": response.status_code,
-                "content_type": response.headers.get('Content-Type', ''), "crawl_time": datetime.now(),
-                "latency_ms": latency, "links": [], "images": [], "title": "", "meta_desc": "",
-                "canonical": "", "page_text": "", "content_hash": "", "indexable": True, "h1_count": 0, "word_count": 0
-            }
-
-            if response.status_code == 200 and 'text/html' in page_data['content_type']:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                page_data['title'] = soup.title.string.strip() if soup.title and soup.title.string else ""
-                meta = soup.find('meta', attrs={'name': 'description'})
-                page_data['meta_desc'] = meta['content'].strip() if meta and meta.get('content') else ""
-                canon = soup.find('link', rel='canonical')
-                page_data['canonical'] = canon['href'] if canon else ""
-                page_data['h1_count'] = len(soup.find_all('h1'))
-                
-                for s in soup(["script", "style"]): s.extract()
-                text_content = soup.get_text(separator=' ', strip=True)
-                page_data['page_text'] = text_content
-                page_data['content_hash'] = get_page_hash(text_content)
-                page_data['word_count'] = len(text_content.split())
-                
-                imgs_found = soup.find_all('img')
-                for i, img in enumerate(imgs_found):
-                    src = img.get('src')
-                    if src:
-                        abs_src = urljoin(url, src)
-                        img_data = {'src': abs_src, 'alt': img.get('alt', ''), 'ocr_text': None}
-                        if i < 5:
-                            detected_text = detect_text_in_image(abs_src)
-                            if detected_text: img_data['ocr_text'] = detected_text
-                        page_data['images'].append(img_data)
-                
-                robots = soup.find('meta', attrs={'name': 'robots'})
-                if robots and 'noindex' in robots.get('content', '').lower(): page_data['indexable'] = False
-                
-                for link in soup.find_all('a', href=True):
-                    raw = link['href'].strip()
-                    if not raw or raw.startswith(('mailto:', 'tel:', 'javascript:', '#')): continue
-                    abs_link = normalize_url(urljoin(url, raw))
-                    if base_domain in urlparse(abs_link).netloc:
-                        page_data['links'].append(abs_link)
-                        if abs_link not in visited and abs_link not in queue: queue.append(abs_link)
-
-            collection.update_one({"url": final_url}, {"$set": page_data}, upsert=True)
-        except Exception as e:
-            collection.update_one({"url": url}, {"$set": {"url": url, "status_code": 0, "error": str(e)}}, upsert=True)
+    # Workers fetch + parse; queue, Mongo writes and UI updates stay on the script thread
+    # Streamlit stops a rerun by raising from the next st.* call, so the flush must survive that too
+    try:
+        with ThreadPoolExecutor(max_workers=CRAWL_WORKERS) as executor:
+            while queue or in_flight:
+                while queue and len(in_flight) < CRAWL_WORKERS and count < CRAWL_MAX_PAGES:
+                    url = queue.popleft()
+                    count += 1
+                    if time.time() - last_progress >= PROGRESS_INTERVAL:
+                        progress_bar.progress(count / CRAWL_MAX_PAGES, text=f"Crawling {count}: {url}")
+                        last_progress = time.time()
+                    in_flight[executor.submit(fetch_page, url, base_domain, session, limiter)] = url
+                if not in_flight: break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url = in_flight.pop(future)
+                    try:
+                        page_data = future.result()
+                        for abs_link in page_data['links']:
+                            if abs_link not in seen:
+                                seen.add(abs_link)
+                                queue.append(abs_link)
+                        # The URL is the document _id, so upserts hit the default _id index
+                        pending.append(UpdateOne({"_id": page_data['url']}, {"$set": page_data}, upsert=True))
+                    except Exception as e:
+                        pending.append(UpdateOne({"_id": url}, {"$set": {"url": url, "status_code": 0, "error": str(e)}}, upsert=True))
 
+                if len(pending) >= MONGO_BATCH_SIZE:
+                    batches.put(pending)
+                    pending = []
+    finally:
+        if pending: batches.put(pending)
+        batches.put(None)
+        writer.join()
     progress_bar.progress(100)
     status_text.success(f"Crawl Complete! Visited {count} pages.")
+    if write_errors: st.warning(f"Some pages could not be saved: {write_errors[0]}")
 
 # --- METRICS ---
-def get_metrics_df():
+def get_collection_version():
+    # Cheap cache key for crawl data: changes whenever a crawl adds, removes or rewrites pages
     col = get_db_collection()
     if col is None: return None
-    data = list(col.find({}, {'page_text': 0, '_id': 0}))
-    df = pd.DataFrame(data)
+    ensure_version_index()
+    try:
+        latest = col.find_one({}, {'crawl_time': 1, '_id': 0}, sort=[('crawl_time', -1)])
+        return col.estimated_document_count(), latest.get('crawl_time') if latest else None
+    except Exception: return None
+
+# Cached per collection version; only the report fields are loaded, with compact dtypes
+@st.cache_data(persist="disk", max_entries=16, show_spinner=False)
+def get_metrics_df(version=None):
+    col = get_db_collection()
+    if col is None: return None
+    cols = ['url', 'title', 'meta_desc', 'canonical', 'status_code', 'content_hash', 'latency_ms', 'indexable', 'h1_count', 'word_count']
+    df = pd.DataFrame.from_records(col.find({}, {c: 1 for c in cols} | {'_id': 0}), columns=cols)
     if df.empty: return None
-    
-    cols = ['url', 'title', 'meta_desc', 'canonical', 'images', 'status_code', 'content_hash', 'latency_ms', 'indexable', 'h1_count', 'word_count']
-    for c in cols: 
-        if c not in df.columns: df[c] = None
         
     df['title'] = df['title'].fillna("")
     df['meta_desc'] = df['meta_desc'].fillna("")
-    df['content_hash'] = df['content_hash'].fillna("")
+    df['content_hash'] = df['content_hash'].fillna("").astype('category')
     df['canonical'] = df['canonical'].fillna("")
-    df['latency_ms'] = pd.to_numeric(df['latency_ms'], errors='coerce').fillna(0)
-    df['h1_count'] = pd.to_numeric(df['h1_count'], errors='coerce').fillna(0)
-    df['word_count'] = pd.to_numeric(df['word_count'], errors='coerce').fillna(0)
+    for c in ['status_code', 'h1_count', 'word_count']:
+        df[c] = pd.to_numeric(pd.to_numeric(df[c], errors='coerce').fillna(0), downcast='unsigned')
+    df['latency_ms'] = pd.to_numeric(pd.to_numeric(df['latency_ms'], errors='coerce').fillna(0), downcast='float')
     
     return df
 
+# Images are unwound and filtered server-side, so only the offending (page, src) pairs are transferred
+def get_missing_alt(col):
+    rows = col.aggregate([
+        # Counted at crawl time, so pages with every alt present are skipped before the unwind;
+        # documents from before the counter existed still go through the unwind
+        {"$match": {"$or": [{"alt_missing_count": {"$gt": 0}}, {"alt_missing_count": {"$exists": False}}]}},
+        {"$unwind": "$images"},
+        {"$match": {"images.alt": {"$in": ["", None]}}},
+        {"$project": {"_id": 0, "Page": "$url", "Image Src": "$images.src"}},
+    ])
+    return pd.DataFrame(list(rows), columns=['Page', 'Image Src'])
+
+# All Tab 1 slices are computed once per collection version, trimmed to the columns each panel shows
+@st.cache_data(max_entries=16, show_spinner=False)
+def get_seo_report(version=None):
+    df = get_metrics_df(version)
+    if df is None: return None
+
+    # One pass over the status codes: 0 = <300, 1 = 3xx, 2 = 4xx, 3 = 5xx+
+    status_codes = df['status_code'].to_numpy()
+    status_bucket = np.digitize(status_codes, [300, 400, 500])
+
+    return {
+        'dup_content': df[df.duplicated(subset=['content_hash'], keep=False) & (df['content_hash'] != "")][['url', 'title']],
+        'dup_title': df[df.duplicated(subset=['title'], keep=False) & (df['title'] != "")][['url', 'title']],
+        'dup_desc': df[df.duplicated(subset=['meta_desc'], keep=False) & (df['meta_desc'] != "")][['url', 'meta_desc']],
+        'canon_issues': df[(df['canonical'] != "") & (df['canonical'] != df['url'])][['url', 'canonical']],
+        'missing_alt': get_missing_alt(get_db_collection()),
+        'broken': df[status_codes == 404][['url', 'status_code']],
+        'r300': df[status_bucket == 1][['url', 'status_code']],
+        'r400': df[status_bucket == 2][['url', 'status_code']],
+        'r500': df[status_bucket == 3][['url', 'status_code']],
+        'indexable': df[df['indexable'] == True][['url', 'title']],
+        'non_indexable': df[df['indexable'] == False][['url', 'title']],
+        'h1_issues': df[(df['h1_count'] == 0) | (df['h1_count'] > 1)][['url', 'h1_count']],
+        'thin_content': df[df['word_count'] < 200][['url', 'word_count']],
+        'slow_pages': df[df['latency_ms'] > 1500][['url', 'latency_ms']],
+    }
+
+@st.cache_data(ttl=300, max_entries=64, show_spinner=False)
+def get_page_doc(url, fields, version=None):
+    col = get_db_collection()
+    if col is None: return None
+    projection = {f: 1 for f in fields} | {'_id': 0}
+    # Pages saved before URLs became the _id still carry an ObjectId, so fall back to the url field
+    return col.find_one({"_id": url}, projection) or col.find_one({"url": url}, projection)
+
+# --- NEAR-DUPLICATES ---
+SHINGLE_SIZE = 5
+MINHASH_PERM = 64
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+def get_text_minhash(text):
+    from datasketch import MinHash
+    tokens = TOKEN_RE.findall(text.lower())
+    shingles = {" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(max(len(tokens) - SHINGLE_SIZE + 1, 1))}
+    mh = MinHash(num_perm=MINHASH_PERM)
+    mh.update_batch([s.encode('utf-8') for s in shingles])
+    return mh
+
+# MinHash-LSH buckets pages by shingle overlap, avoiding an all-pairs comparison
+@st.cache_data(max_entries=16, show_spinner=False)
+def get_near_duplicates(version=None, threshold=0.85):
+    if not DATASKETCH_AVAILABLE: return None
+    col = get_db_collection()
+    if col is None: return None
+    from datasketch import MinHashLSH
+
+    lsh = MinHashLSH(threshold=threshold, num_perm=MINHASH_PERM)
+    hashes, content_hashes = {}, {}
+    for doc in col.find({"page_text": {"$nin": [None, ""]}}, {"url": 1, "page_text": 1, "content_hash": 1, "_id": 0}):
+        mh = get_text_minhash(doc['page_text'])
+        lsh.insert(doc['url'], mh)
+        hashes[doc['url']] = mh
+        content_hashes[doc['url']] = doc.get('content_hash', "")
+
+    # Union-find over the LSH candidates so each near-duplicate cluster gets one root
+    parent = {}
+    def find(u):
+        while parent.get(u, u) != u: u = parent[u]
+        return u
+    for url, mh in hashes.items():
+        for other in lsh.query(mh):
+            root_url, root_other = find(url), find(other)
+            if root_url != root_other: parent[root_other] = root_url
+
+    df = pd.DataFrame({'url': list(hashes), 'group': [find(u) for u in hashes]})
+    df['content_hash'] = df['url'].map(content_hashes)
+    # Clusters of identical text are already covered by the exact content-hash check
+    stats = df.groupby('group')['content_hash'].agg(['size', 'nunique'])
+    near = stats.index[(stats['size'] > 1) & (stats['nunique'] > 1)]
+    df = df[df['group'].isin(near)].sort_values(['group', 'url'])
+    df['group'] = pd.factorize(df['group'])[0] + 1
+    return df[['url', 'group']].reset_index(drop=True)
+
 # --- NLP ---
+# API results are cached per text as plain data; errors raise inside the cached call so they are never cached
+@st.cache_resource(show_spinner=False)
+def get_language_client():
+    from google.cloud import language_v1
+    return language_v1.LanguageServiceClient()
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def run_google_nlp(text):
+    from google.cloud import language_v1
+    client = get_language_client()
+    doc = language_v1.Document(content=text, type_=language_v1.Document.Type.PLAIN_TEXT)
+    sentiment = client.analyze_sentiment(request={'document': doc}).document_sentiment
+    entities = client.analyze_entities(request={'document': doc}).entities
+    return {
+        "sentiment": {"score": sentiment.score, "magnitude": sentiment.magnitude},
+        "entities": [{"name": e.name, "type": language_v1.Entity.Type(e.type_).name, "salience": e.salience} for e in entities]
+    }
+
 def analyze_google(text):
     if not NLP_AVAILABLE: return None, "Library missing."
-    try:
-        client = language_v1.LanguageServiceClient()
-        if not text or len(text.split()) < 20: return None, "Text too short (<20 words)."
-        doc = language_v1.Document(content=text, type_=language_v1.Document.Type.PLAIN_TEXT)
-        sentiment = client.analyze_sentiment(request={'document': doc}).document_sentiment
-        entities = client.analyze_entities(request={'document': doc}).entities
-        return {"sentiment": sentiment, "entities": entities}, None
+    if not text or len(text.split()) < 20: return None, "Text too short (<20 words)."
+    try: return run_google_nlp(text), None
     except Exception as e: return None, str(e)
 
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def run_textrazor(text):
+    import textrazor
+    client = textrazor.TextRazor(extractors=["entities", "topics"])
+    response = client.analyze(text)
+    return {
+        "entities": [{"id": e.id, "relevance": e.relevance_score} for e in sorted(response.entities(), key=lambda x: x.relevance_score, reverse=True)],
+        "topics": [{"label": t.label, "score": t.score} for t in sorted(response.topics(), key=lambda x: x.score, reverse=True)]
+    }
+
 def analyze_textrazor(text, auth_status):
     if not TEXTRAZOR_AVAILABLE: return None, "TextRazor Library missing."
     if not auth_status: return None, "TextRazor API Key missing."
-    try:
-        client = textrazor.TextRazor(extractors=["entities", "topics"])
-        if not text or len(text.strip()) < 50: return None, "Text too short for TextRazor."
-        response = client.analyze(text)
-        return response, None
+    if not text or len(text.strip()) < 50: return None, "Text too short for TextRazor."
+    try: return run_textrazor(text), None
     except Exception as e: return None, str(e)
 
-def scrape_external_page(url):
+# Failures raise so only successful fetches are cached
+@st.cache_data(ttl=3600, max_entries=64, show_spinner=False)
+def fetch_external_text(url):
     if SCRAPER_AVAILABLE:
         try:
+            import cloudscraper
             scraper = cloudscraper.create_scraper(browser={'browser': 'chrome', 'platform': 'windows', 'mobile': False})
             resp = scraper.get(url, timeout=20)
             if resp.status_code == 200:
-                soup = BeautifulSoup(resp.text, 'html.parser')
+                soup = BeautifulSoup(resp.text, 'lxml')
                 for s in soup(["script", "style", "nav", "footer", "iframe", "noscript"]): s.extract()
-                return soup.get_text(separator=' ', strip=True), None
+                return soup.get_text(separator=' ', strip=True)
         except Exception: pass
 
-    try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1'
-        }
-        
-        session = requests.Session()
-        resp = session.get(url, headers=headers, timeout=15, verify=False)
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+        'Accept-Language': 'en-US,en;q=0.5',
+        'Connection': 'keep-alive',
+        'Upgrade-Insecure-Requests': '1'
+    }
+    
+    session = requests.Session()
+    resp = session.get(url, headers=headers, timeout=15, verify=False)
+    
+    if resp.status_code == 200:
+        soup = BeautifulSoup(resp.text, 'lxml')
+        for s in soup(["script", "style", "nav", "footer", "iframe", "noscript"]): s.extract()
+        return soup.get_text(separator=' ', strip=True)
         
-        if resp.status_code == 200:
-            soup = BeautifulSoup(resp.text, 'html.parser')
-            for s in soup(["script", "style", "nav", "footer", "iframe", "noscript"]): s.extract()
-            return soup.get_text(separator=' ', strip=True), None
-            
-        return None, f"Failed to fetch: Status {resp.status_code}"
+    raise RuntimeError(f"Failed to fetch: Status {resp.status_code}")
+
+def scrape_external_page(url):
+    try: return fetch_external_text(url), None
     except Exception as e: return None, str(e)